@@ -39,136 +39,398 @@ Notice:
 import argparse
 from configparser import ConfigParser
 from datetime import datetime
+import functools
+import hashlib
+import json
 import logging
+import os
+import stat
+import tempfile
 import time
 
-from zabbix_api import ZabbixAPI
+import requests
 
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    def json_dumps(obj):
+        """Serializes the given object to JSON bytes, like orjson.dumps."""
+        return json.dumps(obj).encode('utf-8')
+    json_loads = json.loads
 
-def suspend_logging(func):
-    """Suspends logging below warning level cause of ZabbixAPI."""
-    def wrapper(*args, **kwargs):
-        logging.disable(logging.INFO)
-        try:
-            return func(*args, **kwargs)
-        finally:
-            logging.disable(logging.NOTSET)
-    return wrapper
+CONNECT_TIMEOUT = 5
+HOST_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'set_maintenance')
+HOST_CACHE_TTL = 60
+MAINTENANCE_NAME_MAX_LENGTH = 128
+
+
+class ZabbixAPIError(Exception):
+    """Raised when the Zabbix API responds with an error."""
+
+
+class MaintenanceExistsError(Exception):
+    """Raised when a maintenance period with the same name already exists."""
+
+
+class ZabbixAPI:
+    """Minimal Zabbix JSON-RPC client that sends all requests through a single keep-alive HTTP session."""
+
+    def __init__(self, server, api_token, timeout):
+        self.url = f"{server}/api_jsonrpc.php"
+        self.api_token = api_token
+        self.timeout = timeout
+        self.is_bearer_auth = None
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json-rpc'})
 
+    def post(self, request, headers=None):
+        """Posts the given JSON-RPC request and returns its result."""
+        response = self.session.post(self.url, data=json_dumps(request), headers=headers,
+                                     timeout=(CONNECT_TIMEOUT, self.timeout))
+        response.raise_for_status()
+        result = json_loads(response.content)
+        if 'error' in result:
+            error = result['error']
+            raise ZabbixAPIError(f"Error {error['code']}: {error['message']}, {error['data']}")
+        return result['result']
 
-@suspend_logging
-def create_zabbix_authentication(zabbix_server, zabbix_token_auth):
-    """Authenticates to Zabbix using an API token."""
-    zabbix_authentication = ZabbixAPI(server=zabbix_server, timeout=30)
-    zabbix_authentication.login(api_token=zabbix_token_auth)
+    def call(self, method, params):
+        """Calls the given Zabbix API method and returns its result, authenticating the way the server version expects."""
+        if self.is_bearer_auth is None:
+            api_version = self.post({'jsonrpc': '2.0', 'method': 'apiinfo.version', 'params': {}, 'id': 1})
+            self.is_bearer_auth = tuple(int(part) for part in api_version.split('.')[:2]) >= (6, 4)
+        request = {'jsonrpc': '2.0', 'method': method, 'params': params, 'id': 1}
+        if self.is_bearer_auth:
+            return self.post(request, headers={'Authorization': f"Bearer {self.api_token}"})
+        request['auth'] = self.api_token
+        return self.post(request)
+
+
+def create_zabbix_authentication(zabbix_server, zabbix_token_auth, timeout):
+    """Authenticates to Zabbix using an API token, which is sent with every request without a prior login call."""
+    zabbix_authentication = ZabbixAPI(zabbix_server, zabbix_token_auth, timeout)
     return zabbix_authentication
 
 
-@suspend_logging
-def get_host_host_id(zabbix_authentication, host_host):
-    """Gets the ID of the given host by its technical name."""
-    host = zabbix_authentication.host.get({'filter': {'host': [host_host]}})
+def call_host_get_with_hostgroups(zabbix_authentication, host_get_params):
+    """Calls host.get with the host groups IDs of each host under the 'hostgroups' key, using selectGroups on Zabbix 6.0."""
+    try:
+        hosts = zabbix_authentication.call('host.get', {**host_get_params, 'selectHostGroups': ['groupid']})
+    except ZabbixAPIError as err:
+        if 'selectHostGroups' not in str(err):
+            raise
+    else:
+        if all('hostgroups' in host for host in hosts):
+            return hosts
+    # Zabbix 6.0 rejects or silently ignores selectHostGroups, which costs it one extra request here.
+    hosts = zabbix_authentication.call('host.get', {**host_get_params, 'selectGroups': ['groupid']})
+    for host in hosts:
+        host['hostgroups'] = host.pop('groups')
+    return hosts
+
+
+def check_host_cache_dir():
+    """Creates the cache directory if needed and checks that it is a directory accessible only by the current user."""
+    os.makedirs(HOST_CACHE_DIR, mode=0o700, exist_ok=True)
+    cache_dir_stat = os.lstat(HOST_CACHE_DIR)
+    if (not stat.S_ISDIR(cache_dir_stat.st_mode) or cache_dir_stat.st_uid != os.getuid()
+            or stat.S_IMODE(cache_dir_stat.st_mode) != 0o700):
+        raise OSError(f"The cache directory {HOST_CACHE_DIR} must be owned by the current user with mode 0700.")
+
+
+def read_host_cache(cache_key):
+    """Returns the cached host data for the given key unless it is missing, malformed or older than the cache TTL."""
+    cache_path = os.path.join(HOST_CACHE_DIR, f"{cache_key}.json")
+    try:
+        check_host_cache_dir()
+        cache_fd = os.open(cache_path, os.O_RDONLY | os.O_NOFOLLOW)
+        with os.fdopen(cache_fd) as cache_file:
+            cache_file_stat = os.fstat(cache_file.fileno())
+            if cache_file_stat.st_uid != os.getuid() or time.time() - cache_file_stat.st_mtime > HOST_CACHE_TTL:
+                return None
+            host_data = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(host_data, list) or len(host_data) != 2 or not isinstance(host_data[0], str)
+            or not isinstance(host_data[1], list) or not all(isinstance(groupid, str) for groupid in host_data[1])):
+        return None
+    return host_data
+
+
+def write_host_cache(cache_key, host_data):
+    """Stores the host data for the given key, ignoring any errors since the cache is optional."""
+    cache_path = os.path.join(HOST_CACHE_DIR, f"{cache_key}.json")
+    try:
+        check_host_cache_dir()
+        cache_fd, cache_tmp_path = tempfile.mkstemp(dir=HOST_CACHE_DIR, suffix='.tmp')
+    except OSError:
+        return
+    try:
+        with os.fdopen(cache_fd, 'w') as cache_file:
+            json.dump(host_data, cache_file)
+        os.replace(cache_tmp_path, cache_path)
+    except OSError:
+        try:
+            os.unlink(cache_tmp_path)
+        except OSError:
+            pass
+
+
+def get_host_with_hostgroups(zabbix_authentication, host_host):
+    """Gets the ID and the host groups IDs of the given host by its technical name, using a short-lived cache."""
+    cache_key = hashlib.sha256(f"{zabbix_authentication.url}\n{host_host}".encode()).hexdigest()
+    host_data = read_host_cache(cache_key)
+    if host_data is not None:
+        host_host_id, host_hostgroups_groupids = host_data
+        return host_host_id, host_hostgroups_groupids
+    host = call_host_get_with_hostgroups(zabbix_authentication, {
+        'output': ['hostid'],
+        'filter': {'host': [host_host]}
+    })
     host_host_id = host[0]['hostid']
-    return host_host_id
-
-
-@suspend_logging
-def get_host_hostgroups_names(zabbix_authentication, host_host_id):
-    """Gets the host groups names of the given host by its id."""
-    host_hostgroups = zabbix_authentication.hostgroup.get({'output': ['name'], 'hostids': host_host_id})
-    host_hostgroups_names = [host_hostgroup['name'] for host_hostgroup in host_hostgroups]
-    return host_hostgroups_names
-
-
-@suspend_logging
-def find_smallest_host_hostgroup(zabbix_authentication, host_hostgroups_names):
-    """Finds the host group with the fewest number of hosts among the given host groups names."""
-    smallest_host_hostgroup = None
-    hostgroup_hosts_count_min = None
-    for host_hostgroup_name in host_hostgroups_names:
-        host_hostgroup = zabbix_authentication.hostgroup.get({
-            'output': ['groupid', 'name'],
-            'filter': {'name': host_hostgroup_name},
-            'selectHosts': ['hostid']
-        })
-        if host_hostgroup:
-            hostgroup_hosts_count = len(host_hostgroup[0]['hosts'])
-            if hostgroup_hosts_count_min is None or hostgroup_hosts_count < hostgroup_hosts_count_min:
-                hostgroup_hosts_count_min = hostgroup_hosts_count
-                smallest_host_hostgroup = {
-                    'hostgroup_groupid': host_hostgroup[0]['groupid'],
-                    'hostgroup_name': host_hostgroup[0]['name']
-                }
+    host_hostgroups_groupids = [host_hostgroup['groupid'] for host_hostgroup in host[0]['hostgroups']]
+    write_host_cache(cache_key, [host_host_id, host_hostgroups_groupids])
+    return host_host_id, host_hostgroups_groupids
+
+
+def read_hosts_file(hosts_file):
+    """Reads the technical names of hosts from the given file, one per line, skipping blank lines."""
+    with open(hosts_file) as file:
+        hosts_hosts = [line.strip() for line in file if line.strip()]
+    return hosts_hosts
+
+
+def get_hosts_with_hostgroups(zabbix_authentication, hosts_hosts):
+    """Gets the IDs and the host groups IDs of the given hosts by their technical names in a single request."""
+    hosts = call_host_get_with_hostgroups(zabbix_authentication, {
+        'output': ['hostid', 'host'],
+        'filter': {'host': hosts_hosts}
+    })
+    hosts_with_hostgroups = {
+        host['host']: (host['hostid'], [host_hostgroup['groupid'] for host_hostgroup in host['hostgroups']])
+        for host in hosts
+    }
+    return hosts_with_hostgroups
+
+
+def find_smallest_host_hostgroup(zabbix_authentication, host_hostgroups_groupids):
+    """Finds the host group with the fewest number of hosts among the given host groups IDs."""
+    host_hostgroups = zabbix_authentication.call('hostgroup.get', {
+        'output': ['groupid', 'name'],
+        'groupids': host_hostgroups_groupids,
+        'selectHosts': 'count'
+    })
+    if not host_hostgroups:
+        return None
+    host_hostgroup = min(host_hostgroups, key=lambda hostgroup: int(hostgroup['hosts']))
+    smallest_host_hostgroup = {
+        'hostgroup_groupid': host_hostgroup['groupid'],
+        'hostgroup_name': host_hostgroup['name']
+    }
     return smallest_host_hostgroup
 
 
+def find_smallest_hosts_hostgroups(zabbix_authentication, hosts_hostgroups_groupids):
+    """Finds the host group with the fewest number of hosts for each of the given hosts in a single request."""
+    hostgroups_groupids = sorted({
+        groupid for host_hostgroups_groupids in hosts_hostgroups_groupids for groupid in host_hostgroups_groupids
+    })
+    hostgroups = zabbix_authentication.call('hostgroup.get', {
+        'output': ['groupid', 'name'],
+        'groupids': hostgroups_groupids,
+        'selectHosts': 'count'
+    })
+    hostgroups_by_groupid = {hostgroup['groupid']: hostgroup for hostgroup in hostgroups}
+    smallest_hosts_hostgroups = {}
+    for host_hostgroups_groupids in hosts_hostgroups_groupids:
+        host_hostgroups = [
+            hostgroups_by_groupid[groupid] for groupid in host_hostgroups_groupids if groupid in hostgroups_by_groupid
+        ]
+        if host_hostgroups:
+            host_hostgroup = min(host_hostgroups, key=lambda hostgroup: int(hostgroup['hosts']))
+            smallest_hosts_hostgroups[host_hostgroup['groupid']] = host_hostgroup['name']
+    return smallest_hosts_hostgroups
+
+
 def create_maintenance_time_params(period, is_data_collection, user):
-    """Returns a part of the parameters necessary for the Zabbix API method allows to create a maintenance period."""
+    """Returns the values shared by all maintenance periods created in a single run, based on one captured time."""
     active_since = int(time.time())
-    active_till = active_since + period
-    maintenance_type = int(is_data_collection)
-    description = f"The maintenance period was created using the script by {user}."
-    maintenance_common_params = {
+    maintenance_time_params = {
         'active_since': active_since,
-        'active_till': active_till,
-        'timeperiods': [{'period': period}],
-        'maintenance_type': maintenance_type,
-        'description': description,
+        'active_till': active_since + period,
+        'period': period,
+        'maintenance_type': int(is_data_collection),
+        'description': f"The maintenance period was created using the script by {user}.",
+        'formatted_active_since': datetime.fromtimestamp(active_since).strftime("%Y-%m-%d %H:%M"),
     }
-    return maintenance_common_params
+    return maintenance_time_params
+
 
+def format_maintenance_name(subject, formatted_active_since):
+    """Returns the name of a maintenance period for the given subject and start time."""
+    return f"Maintenance period for {subject} since {formatted_active_since}"
 
-@suspend_logging
-def create_maintenance_for_host(zabbix_authentication, maintenance_common_params, host_host, host_id):
+
+def create_maintenance(zabbix_authentication, maintenance_time_params, subject, **targets):
+    """Creates a new maintenance period named after the given subject for the given hosts or host groups, unless it already exists."""
+    name = format_maintenance_name(subject, maintenance_time_params['formatted_active_since'])
+    existing_maintenances = zabbix_authentication.call('maintenance.get', {
+        'output': ['maintenanceid'],
+        'filter': {'name': name}
+    })
+    if existing_maintenances:
+        raise MaintenanceExistsError(f"The maintenance period '{name}' already exists.")
+    maintenance_params = {
+        'name': name,
+        'active_since': maintenance_time_params['active_since'],
+        'active_till': maintenance_time_params['active_till'],
+        'timeperiods': [{'period': maintenance_time_params['period']}],
+        'maintenance_type': maintenance_time_params['maintenance_type'],
+        'description': maintenance_time_params['description'],
+        **targets,
+    }
+    zabbix_authentication.call('maintenance.create', maintenance_params)
+
+
+def create_maintenance_for_host(zabbix_authentication, maintenance_time_params, host_host, host_id):
     """Creates a new maintenance period for the given host."""
-    formatted_active_since = datetime.fromtimestamp(maintenance_common_params['active_since']).strftime("%Y-%m-%d %H:%M")
-    name = f"Maintenance period for the host {host_host} since {formatted_active_since}"
-    maintenance_common_params['name'] = name
-    maintenance_common_params['hosts'] = [{'hostid': host_id}]
-    zabbix_authentication.maintenance.create(maintenance_common_params)
+    create_maintenance(zabbix_authentication, maintenance_time_params, f"the host {host_host}",
+                       hosts=[{'hostid': host_id}])
 
 
-@suspend_logging
-def create_maintenance_for_hostgroup(zabbix_authentication, maintenance_common_params, hostgroup_name, hostgroup_groupid):
+def create_maintenance_for_hostgroup(zabbix_authentication, maintenance_time_params, hostgroup_name, hostgroup_groupid):
     """Creates a new maintenance period for the given host group."""
-    formatted_active_since = datetime.fromtimestamp(maintenance_common_params['active_since']).strftime("%Y-%m-%d %H:%M")
-    name = f"Maintenance period for the hostgroup {hostgroup_name} since {formatted_active_since}"
-    maintenance_common_params['name'] = name
-    maintenance_common_params['groups'] = [{'groupid': hostgroup_groupid}]
-    zabbix_authentication.maintenance.create(maintenance_common_params)
+    create_maintenance(zabbix_authentication, maintenance_time_params, f"the hostgroup {hostgroup_name}",
+                       groups=[{'groupid': hostgroup_groupid}])
 
 
-def main():
-    """Execute the main logic of the script."""
-    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s",
-                        level=logging.INFO, datefmt="%Y-%m-%d %H:%M:%S")
-    parser = argparse.ArgumentParser()
+def describe_maintenance_targets(target_kind, targets_names, targets_ids, formatted_active_since):
+    """Returns the part of the maintenance period name describing the given targets, distinct for distinct sets of targets."""
+    if len(targets_ids) == 1:
+        subject_template = f"the {target_kind} {{}}"
+    else:
+        targets_digest = hashlib.sha256(",".join(sorted(targets_ids)).encode()).hexdigest()[:8]
+        subject_template = f"the {target_kind}s {{}} and {len(targets_ids) - 1} more ({targets_digest})"
+    first_target_name = targets_names[0]
+    name_length = len(format_maintenance_name(subject_template.format(first_target_name), formatted_active_since))
+    # Shorten the first target name so that the whole name fits the Zabbix limit on maintenance names.
+    excess_length = name_length - MAINTENANCE_NAME_MAX_LENGTH
+    if excess_length > 0:
+        first_target_name = first_target_name[:max(len(first_target_name) - excess_length - 3, 0)] + "..."
+    return subject_template.format(first_target_name)
+
+
+def create_maintenance_for_hosts(zabbix_authentication, maintenance_time_params, hosts_ids_by_name):
+    """Creates a single new maintenance period for all the given hosts."""
+    hosts_ids = list(hosts_ids_by_name.values())
+    subject = describe_maintenance_targets("host", list(hosts_ids_by_name), hosts_ids,
+                                           maintenance_time_params['formatted_active_since'])
+    create_maintenance(zabbix_authentication, maintenance_time_params, subject,
+                       hosts=[{'hostid': host_id} for host_id in hosts_ids])
+
+
+def create_maintenance_for_hostgroups(zabbix_authentication, maintenance_time_params, hostgroups_names_by_groupid):
+    """Creates a single new maintenance period for all the given host groups."""
+    hostgroups_groupids = list(hostgroups_names_by_groupid)
+    subject = describe_maintenance_targets("hostgroup", list(hostgroups_names_by_groupid.values()), hostgroups_groupids,
+                                           maintenance_time_params['formatted_active_since'])
+    create_maintenance(zabbix_authentication, maintenance_time_params, subject,
+                       groups=[{'groupid': hostgroup_groupid} for hostgroup_groupid in hostgroups_groupids])
+
+
+def set_maintenance_for_hosts_file(zabbix_authentication, maintenance_time_params, hosts_file, is_hostgroup):
+    """Creates a single maintenance period for all hosts listed in the given file or for their smallest host groups."""
+    try:
+        hosts_hosts = read_hosts_file(hosts_file)
+    except OSError as err:
+        logging.error("Failed to read the hosts file %s. Error: %s", hosts_file, err)
+        return
+    if not hosts_hosts:
+        logging.error("No hosts are listed in %s.", hosts_file)
+        return
+    hosts_with_hostgroups = get_hosts_with_hostgroups(zabbix_authentication, hosts_hosts)
+    for host_host in hosts_hosts:
+        if host_host not in hosts_with_hostgroups:
+            logging.warning("The host %s was not found and will be skipped.", host_host)
+    if not hosts_with_hostgroups:
+        logging.error("None of the hosts listed in %s were found.", hosts_file)
+        return
+    if is_hostgroup:
+        hosts_hostgroups_groupids = [
+            host_hostgroups_groupids for _, host_hostgroups_groupids in hosts_with_hostgroups.values()
+        ]
+        smallest_hosts_hostgroups = find_smallest_hosts_hostgroups(zabbix_authentication, hosts_hostgroups_groupids)
+        if not smallest_hosts_hostgroups:
+            logging.error("No host groups were found for the hosts listed in %s.", hosts_file)
+            return
+        hostgroups_names = ", ".join(smallest_hosts_hostgroups.values())
+        try:
+            create_maintenance_for_hostgroups(zabbix_authentication, maintenance_time_params, smallest_hosts_hostgroups)
+            logging.info("The maintenance period for the host groups %s was successfully created.", hostgroups_names)
+        except MaintenanceExistsError as err:
+            logging.warning("The maintenance period for the host groups %s was not created. %s", hostgroups_names, err)
+        except Exception as err:
+            logging.error("Failed to create the maintenance period for the host groups %s. Error: %s", hostgroups_names, err)
+    else:
+        hosts_ids_by_name = {host_host: host_id for host_host, (host_id, _) in hosts_with_hostgroups.items()}
+        hosts_names = ", ".join(hosts_with_hostgroups)
+        try:
+            create_maintenance_for_hosts(zabbix_authentication, maintenance_time_params, hosts_ids_by_name)
+            logging.info("The maintenance period for the hosts %s was successfully created.", hosts_names)
+        except MaintenanceExistsError as err:
+            logging.warning("The maintenance period for the hosts %s was not created. %s", hosts_names, err)
+        except Exception as err:
+            logging.error("Failed to create the maintenance period for the hosts %s. Error: %s", hosts_names, err)
+
+
+@functools.lru_cache(maxsize=None)
+def _build_parser():
+    """Builds the command-line arguments parser once and reuses it on subsequent calls."""
+    parser = argparse.ArgumentParser(allow_abbrev=False)
     parser.add_argument("credentials_file", help="configuration file with necessary variables for Zabbix")
-    parser.add_argument("host", help="technical name of the host")
+    parser.add_argument("host", nargs="?", help="technical name of the host")
+    parser.add_argument("--hosts-file", help="file with technical names of hosts, one per line, to create a single maintenance period for all of them")
     parser.add_argument("--period", type=int, default=3600, help="duration of the maintenance period in seconds")
     parser.add_argument("--no-data-collection", action="store_true", dest="is_data_collection", help="without data collection")
     parser.add_argument("--hostgroup", action="store_true", help="create a maintenance period for the entire and smallest host group to which the host belongs")
     parser.add_argument("--user", default="unknown user", help="user name added to the description")
-    args = parser.parse_args()
+    parser.add_argument("--timeout", type=int, default=30, help="time in seconds to wait for a Zabbix API response")
+    return parser
+
+
+def main(argv=None):
+    """Execute the main logic of the script."""
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s",
+                        level=logging.INFO, datefmt="%Y-%m-%d %H:%M:%S")
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    if (args.host is None) == (args.hosts_file is None):
+        parser.error("exactly one of host or --hosts-file must be given")
     config = ConfigParser()
     config.read(args.credentials_file)
     zabbix_server = config.get('zabbix', 'SERVER')
     zabbix_token_auth = config.get('zabbix', 'TOKEN_AUTH')
-    zabbix_authentication = create_zabbix_authentication(zabbix_server, zabbix_token_auth)
+    zabbix_authentication = create_zabbix_authentication(zabbix_server, zabbix_token_auth, args.timeout)
     maintenance_time_params = create_maintenance_time_params(args.period, args.is_data_collection, args.user)
-    host_host_id = get_host_host_id(zabbix_authentication, args.host)
+    if args.hosts_file is not None:
+        set_maintenance_for_hosts_file(zabbix_authentication, maintenance_time_params, args.hosts_file, args.hostgroup)
+        return
+    host_host_id, host_hostgroups_groupids = get_host_with_hostgroups(zabbix_authentication, args.host)
     if args.hostgroup:
-        host_hostgroups_names = get_host_hostgroups_names(zabbix_authentication, host_host_id)
-        smallest_host_hostgroup = find_smallest_host_hostgroup(zabbix_authentication, host_hostgroups_names)
+        smallest_host_hostgroup = find_smallest_host_hostgroup(zabbix_authentication, host_hostgroups_groupids)
         try:
             create_maintenance_for_hostgroup(zabbix_authentication, maintenance_time_params, **smallest_host_hostgroup)
             logging.info("The maintenance period for the host group %s was successfully created.", smallest_host_hostgroup['hostgroup_name'])
+        except MaintenanceExistsError as err:
+            logging.warning("The maintenance period for the host group %s was not created. %s", smallest_host_hostgroup['hostgroup_name'], err)
         except Exception as err:
             logging.error("Failed to create the maintenance period for the host group %s. Error: %s", smallest_host_hostgroup['hostgroup_name'], err)
     else:
         try:
             create_maintenance_for_host(zabbix_authentication, maintenance_time_params, args.host, host_host_id)
             logging.info("The maintenance period for the host %s was successfully created.", args.host)
+        except MaintenanceExistsError as err:
+            logging.warning("The maintenance period for the host %s was not created. %s", args.host, err)
         except Exception as err:
             logging.error("Failed to create the maintenance period for the host %s. Error: %s", args.host, err)
 